@@ -10,7 +10,7 @@
 
 import sys
 from svbatcher.utils import io, printers
-from svbatcher.data_types import Individual, Family
+from svbatcher.data_types import Individual, Family, BatchStats, BatchPlan
 import numpy as np
 
 # Default parameters
@@ -23,12 +23,18 @@ DEFAULT_SEX_BALANCED = 0
 MIN_COVERAGE_QUANTILES = 1
 MIN_TARGET_BATCH_SIZE = 1
 
+# Relative precision of the batch size search used for plan suggestions
+PLAN_SEARCH_TOLERANCE = 0.05
+
 
 class SVBatcher:
     def __init__(self):
         self.individuals_dict = None
         self.families = None
         self.batches = None
+        self.sample_ids = None
+        self.pedigree = None
+        self.batch_indices = None
 
     def _set_all_proband(self):
         for sample_id in self.individuals_dict:
@@ -97,24 +103,17 @@ class SVBatcher:
     def _family_size(self, family):
         return family.size()
 
-    def _batch_families_not_sex_balanced(self, num_coverage_batches, num_wgd_batches):
+    def _iter_batches_not_sex_balanced(self, num_coverage_batches, num_wgd_batches):
         # Split into quantiles based on coverage
         families_by_coverage = self._split_batch_by_sorting(self.families, num_coverage_batches, self._family_coverage, self._family_size)
 
-        # Split by WGD
-        families_by_wgd = []
+        # Split each quantile by WGD, yielding its batches as soon as the quantile is done
         for cov_batch in families_by_coverage:
             wgd_batch = self._split_batch_by_sorting(cov_batch, num_wgd_batches, self._family_dosage_score, self._family_size)
-            families_by_wgd.append(wgd_batch)
-
-        # Flatten into final batch list
-        final_batches = []
-        for cov_batch in families_by_wgd:
-            for wgd_batch in cov_batch:
-                final_batches.append(wgd_batch)
-        return final_batches
+            for batch in wgd_batch:
+                yield batch
 
-    def _batch_families_sex_balanced(self, num_coverage_batches, num_wgd_batches):
+    def _iter_batches_sex_balanced(self, num_coverage_batches, num_wgd_batches):
         #Split first by sex
         sexes, families_by_sex = self._split_batch_by_categorizing(self.families, self._family_sex)
 
@@ -124,29 +123,87 @@ class SVBatcher:
             cov_batches = self._split_batch_by_sorting(sex_batch, num_coverage_batches, self._family_coverage, self._family_size)
             families_by_coverage.append(cov_batches)
 
-        # Split by WGD
-        families_by_wgd = []
-        for sex_batch in families_by_coverage:
-            families_by_wgd.append([])
-            for cov_batch in sex_batch:
-                wgd_batch = self._split_batch_by_sorting(cov_batch, num_wgd_batches, self._family_dosage_score, self._family_size)
-                families_by_wgd[-1].append(wgd_batch)
-
-        # Merge sexes and flatten into final batch list
-        final_batches = []
+        # Split each quantile by WGD and merge sexes, yielding its batches as soon as the quantile is done
         num_sexes = len(sexes)
         for cov_idx in range(num_coverage_batches):
+            families_by_wgd = []
+            for i in range(num_sexes):
+                families_by_wgd.append(self._split_batch_by_sorting(families_by_coverage[i][cov_idx], num_wgd_batches, self._family_dosage_score, self._family_size))
             for wgd_idx in range(num_wgd_batches):
-                merged_batch = self._merge_batches([families_by_wgd[i][cov_idx][wgd_idx] for i in range(num_sexes)])
-                final_batches.append(merged_batch)
-        return final_batches
+                yield self._merge_batches([families_by_wgd[i][wgd_idx] for i in range(num_sexes)])
+
+    def _reset_batches(self):
+        self.families = None
+        self.batches = None
+        self.batch_indices = None
 
     def load_cohort(self, cohort_path, sex_assignment_list_path, wgd_list_path):
         self.individuals_dict = io.read_coverage_file(cohort_path)
         self.individuals_dict = io.read_sex_assignment_list(sex_assignment_list_path, self.individuals_dict)
         self.individuals_dict = io.read_wgd_list(wgd_list_path, self.individuals_dict)
+        self.sample_ids = None
+        self.pedigree = None
+        self._reset_batches()
+        return self.individuals_dict
+
+    # Loads the cohort from in-memory columns instead of files. Columns may be numpy arrays, lists, buffer
+    # protocol objects or DataFrame columns; they are converted with numpy and one Individual is built per
+    # sample, as with load_cohort. Sex values use the same strings as sex assignment files. The optional
+    # pedigree columns replace a ped file: ped_sample_ids defaults to sample_ids, and ped_proband holds
+    # booleans or PED phenotype codes (strings or integers, 2 for probands).
+    def load_cohort_arrays(self, sample_ids, coverage, sex, wgd, ped_family_ids=None, ped_proband=None, ped_sample_ids=None):
+        sample_ids = np.asarray(sample_ids)
+        coverage = np.asarray(coverage, dtype=float)
+        wgd = np.asarray(wgd, dtype=float)
+        sex = np.asarray(sex)
+        num_samples = len(sample_ids)
+        if len(coverage) != num_samples or len(sex) != num_samples or len(wgd) != num_samples:
+            printers.raise_error("Sample id, coverage, sex and WGD arrays must have the same length")
+        is_male = sex == io.SEX_ASSIGNMENT_MALE_STRING
+        is_female = sex == io.SEX_ASSIGNMENT_FEMALE_STRING
+
+        individuals_dict = {}
+        for sample_id, sample_coverage, sample_wgd, male, female in zip(sample_ids.tolist(), coverage.tolist(), wgd.tolist(), is_male.tolist(), is_female.tolist()):
+            sample_id = str(sample_id)
+            if sample_id not in individuals_dict:
+                individuals_dict[sample_id] = Individual(sample_id)
+            individual = individuals_dict[sample_id]
+            individual.coverage = sample_coverage
+            individual.wgd = sample_wgd
+            if male:
+                individual.set_male()
+            elif female:
+                individual.set_female()
+            else:
+                individual.set_sex_other()
+
+        if (ped_family_ids is None) != (ped_proband is None):
+            printers.raise_error("Pedigree family id and proband arrays must be provided together")
+        if ped_family_ids is not None:
+            if ped_sample_ids is None:
+                ped_sample_ids = sample_ids
+            if len(ped_family_ids) != len(ped_sample_ids) or len(ped_proband) != len(ped_sample_ids):
+                printers.raise_error("Pedigree family id, sample id and proband arrays must have the same length")
+            self.pedigree = (ped_family_ids, ped_sample_ids, io.get_proband_flags(ped_proband))
+        else:
+            self.pedigree = None
+
+        self.individuals_dict = individuals_dict
+        self.sample_ids = sample_ids
+        self._reset_batches()
         return self.individuals_dict
 
+    # Returns the batch index of each sample as an array, aligned with sample_ids (by default the ids
+    # given to load_cohort_arrays, otherwise all loaded samples). Samples not in any batch get -1.
+    # Works after batch_cohort, batch_cohort_and_write or iterating iter_batches.
+    def get_batch_assignments(self, sample_ids=None):
+        if self.batch_indices is None:
+            printers.raise_error("No batches to assign; run batch_cohort first")
+        if sample_ids is None:
+            sample_ids = self.sample_ids if self.sample_ids is not None else list(self.individuals_dict.keys())
+        sample_ids = np.asarray(sample_ids)
+        return np.array([self.batch_indices.get(str(x), -1) for x in sample_ids.tolist()], dtype=int)
+
     def _get_array_stats(self, array):
         return [np.mean(array), np.std(array), np.min(array), np.max(array)]
 
@@ -165,19 +222,46 @@ class SVBatcher:
                 metrics[-1][2] = np.mean(metrics_other)
         return metrics
 
-    def batch_cohort(self,
-                     target_batch_size=DEFAULT_BATCH_SIZE,
-                     num_coverage_quantiles=None,
-                     min_sex_count=DEFAULT_MIN_SEX_COUNT,
-                     use_sex_balancing=DEFAULT_SEX_BALANCED,
-                     ped_file_path=None,
-                     verbosity=DEFAULT_VERBOSITY):
-        # Set number of quantiles
-        cohort_size = len(self.individuals_dict)
+    def _get_batch_stats(self, batch):
+        stats = BatchStats()
+        stats.size = sum([x.size() for x in batch])
+        stats.num_male = sum([x.num_male() for x in batch])
+        stats.num_female = sum([x.num_female() for x in batch])
+        stats.num_sex_other = sum([x.num_sex_other() for x in batch])
+        stats.sex_ratio = stats.num_female / float(stats.num_male)
+        stats.coverage = self._get_mean_batch_metrics_by_sex([batch], self._family_coverage)[0]
+        stats.wgd = self._get_mean_batch_metrics_by_sex([batch], self._family_dosage_score)[0]
+        return stats
+
+    def _get_num_coverage_quantiles(self, cohort_size, target_batch_size, num_coverage_quantiles):
         if num_coverage_quantiles is None:
             num_coverage_quantiles = max(int(cohort_size/float(4*target_batch_size)), MIN_COVERAGE_QUANTILES)
         elif num_coverage_quantiles < MIN_COVERAGE_QUANTILES:
             printers.raise_error("Number of coverage quantiles must be >= " + str(MIN_COVERAGE_QUANTILES))
+        return num_coverage_quantiles
+
+    def _get_num_wgd_batches(self, cohort_size, num_coverage_quantiles, target_batch_size):
+        return int((cohort_size / num_coverage_quantiles) / target_batch_size)
+
+    def _build_families(self, ped_file_path):
+        # If no pedigree provided, put each individual into a singleton family as a proband
+        if ped_file_path:
+            self.families = io.assign_families(ped_file_path, self.individuals_dict)
+        elif self.pedigree is not None:
+            self.families = io.assign_families_from_arrays(self.pedigree[0], self.pedigree[1], self.pedigree[2], self.individuals_dict)
+        else:
+            self._set_all_proband()
+            self.families = self._wrap_individuals()
+
+        # Input consistency check
+        self._check_families()
+
+    # Validates parameters and builds families. Returns the number of coverage quantiles, the number
+    # of WGD batches per quantile and the cohort size.
+    def _prepare_batching(self, target_batch_size, num_coverage_quantiles, use_sex_balancing, ped_file_path, verbosity):
+        # Set number of quantiles
+        cohort_size = len(self.individuals_dict)
+        num_coverage_quantiles = self._get_num_coverage_quantiles(cohort_size, target_batch_size, num_coverage_quantiles)
 
         if target_batch_size < MIN_TARGET_BATCH_SIZE:
             printers.raise_error("Target batch size must be >= " + str(MIN_TARGET_BATCH_SIZE))
@@ -189,37 +273,22 @@ class SVBatcher:
             printers.print_parameter("Cohort size", cohort_size)
             printers.print_parameter("Sex balancing", use_sex_balancing)
 
-        # If ped file not provided, put each individual into a singleton family as a proband
-        if not ped_file_path:
-            self._set_all_proband()
-            self.families = self._wrap_individuals()
-        else:
-            self.families = io.assign_families(ped_file_path, self.individuals_dict)
-
-        # Input consistency check
-        self._check_families()
+        self._build_families(ped_file_path)
 
         # Compute number of wgd batches
         cohort_size = sum([self._family_size(x) for x in self.families])
-        num_wgd_batches = int((cohort_size / num_coverage_quantiles) / target_batch_size)
+        num_wgd_batches = self._get_num_wgd_batches(cohort_size, num_coverage_quantiles, target_batch_size)
+        return num_coverage_quantiles, num_wgd_batches, cohort_size
 
-        # Run batching
-        if use_sex_balancing:
-            printers.print_warning("Sex balancing may result in poorer metric clustering.")
-            batches = self._batch_families_sex_balanced(num_coverage_quantiles, num_wgd_batches)
-        else:
-            batches = self._batch_families_not_sex_balanced(num_coverage_quantiles, num_wgd_batches)
-
-        # Stats
-        num_batches = len(batches)
-        batch_sizes = [sum([x.size() for x in y]) for y in batches]
+    # Prints summary stats and enforces constraints over all batches
+    def _check_batch_stats(self, batch_stats, cohort_size, min_sex_count, verbosity):
+        num_batches = len(batch_stats)
+        batch_sizes = [x.size for x in batch_stats]
         batched_cohort_size = sum(batch_sizes)
-        batch_sizes_male = [sum([x.num_male() for x in y]) for y in batches]
-        batch_sizes_female = [sum([x.num_female() for x in y]) for y in batches]
-        batch_sizes_sex_other = [sum([x.num_sex_other() for x in y]) for y in batches]
-        batch_sex_ratios = [batch_sizes_female[i] / float(batch_sizes_male[i]) for i in range(num_batches)]
-        batch_coverage = self._get_mean_batch_metrics_by_sex(batches, self._family_coverage)
-        batch_wgd = self._get_mean_batch_metrics_by_sex(batches, self._family_dosage_score)
+        batch_sizes_male = [x.num_male for x in batch_stats]
+        batch_sizes_female = [x.num_female for x in batch_stats]
+        batch_sizes_sex_other = [x.num_sex_other for x in batch_stats]
+        batch_sex_ratios = [x.sex_ratio for x in batch_stats]
 
         if verbosity:
             sys.stderr.write("################ Results ################\n")
@@ -230,10 +299,10 @@ class SVBatcher:
             printers.print_parameter("Batch females (mean/std/min/max)", self._get_array_stats(batch_sizes_female))
             printers.print_parameter("Batch other sex (mean/std/min/max)", self._get_array_stats(batch_sizes_sex_other))
             printers.print_parameter("Batch F/M ratio (mean/std/min/max)", self._get_array_stats(batch_sex_ratios))
-            for cov in batch_coverage:
-                printers.print_parameter("Mean coverage (male/female/other)", cov)
-            for wgd in batch_wgd:
-                printers.print_parameter("Mean dosage score (male/female/other)", wgd)
+            for stats in batch_stats:
+                printers.print_parameter("Mean coverage (male/female/other)", stats.coverage)
+            for stats in batch_stats:
+                printers.print_parameter("Mean dosage score (male/female/other)", stats.wgd)
 
         # Enforce min_sex_count
         min_male_count = np.min(batch_sizes_male)
@@ -245,8 +314,256 @@ class SVBatcher:
         if batched_cohort_size != cohort_size:
             printers.raise_error("!!!!!!!! Final batched cohort size does not equal the input cohort size !!!!!!!!")
 
+    # Returns per-family arrays for planning. If families is None, each proband is its own family.
+    def _get_family_arrays(self, probands, families=None):
+        coverage = [x.coverage for x in probands]
+        wgd = [x.wgd for x in probands]
+        if families is None and (None in coverage or None in wgd or None in [x.sex for x in probands]):
+            for ind in probands:
+                if ind.coverage is None or ind.wgd is None or ind.sex is None:
+                    printers.raise_error("Individual not fully defined: " + str(ind))
+        coverage = np.array(coverage, dtype=float)
+        wgd = np.array(wgd, dtype=float)
+        proband_male = np.array([x.is_male() for x in probands], dtype=bool)
+        proband_female = np.array([x.is_female() for x in probands], dtype=bool)
+        if families is None:
+            sizes = np.ones(len(probands), dtype=int)
+            num_male = proband_male.astype(int)
+            num_female = proband_female.astype(int)
+        else:
+            sizes = np.array([self._family_size(x) for x in families], dtype=int)
+            num_male = np.array([x.num_male() for x in families], dtype=int)
+            num_female = np.array([x.num_female() for x in families], dtype=int)
+        # WGD ties are broken by coverage order, as in the stable sort of each coverage quantile
+        coverage_order = np.argsort(coverage, kind='mergesort')
+        coverage_rank = np.empty(len(coverage), dtype=np.int64)
+        coverage_rank[coverage_order] = np.arange(len(coverage))
+        wgd_rank = np.empty(len(wgd), dtype=np.int64)
+        wgd_rank[np.lexsort((coverage_rank, wgd))] = np.arange(len(wgd))
+        return {"sizes": sizes,
+                "coverage": coverage,
+                "wgd": wgd,
+                "num_male": num_male,
+                "num_female": num_female,
+                "num_sex_other": sizes - num_male - num_female,
+                "sex": np.where(proband_male, 0, np.where(proband_female, 1, 2)),
+                # Sorted once here so plan evaluations only need to sort integer keys
+                "coverage_order": coverage_order,
+                "wgd_rank": wgd_rank}
+
+    def _get_group_arrays(self, family_arrays, group):
+        if group is None:
+            return family_arrays
+        # Sorting is preserved when selecting a subset of the precomputed orders
+        group_arrays = {}
+        for name in ["sizes", "coverage", "wgd", "num_male", "num_female", "num_sex_other"]:
+            group_arrays[name] = family_arrays[name][group]
+        group_idx = np.cumsum(group) - 1
+        order = family_arrays["coverage_order"]
+        group_arrays["coverage_order"] = group_idx[order[group[order]]]
+        group_arrays["wgd_rank"] = family_arrays["wgd_rank"][group]
+        return group_arrays
+
+    # Predicts the batch index of each family, reproducing _split_batch_by_sorting from ranks that
+    # are computed once per cohort: coverage quantiles by cumulative size in coverage order, then
+    # WGD splits by cumulative size in WGD order within each quantile.
+    def _predict_batch_indices(self, arrays, num_coverage_batches, num_wgd_batches):
+        sizes = arrays["sizes"]
+        total_size = float(np.sum(sizes))
+        coverage_order = arrays["coverage_order"]
+        ordered_sizes = sizes[coverage_order]
+        coverage_idx = np.empty(len(sizes), dtype=np.int64)
+        coverage_idx[coverage_order] = ((np.cumsum(ordered_sizes) - ordered_sizes) / total_size * num_coverage_batches).astype(np.int64)
+
+        wgd_rank = arrays["wgd_rank"]
+        order = np.argsort(coverage_idx * (np.max(wgd_rank) + 1) + wgd_rank)
+        ordered_sizes = sizes[order]
+        ordered_coverage_idx = coverage_idx[order]
+        quantile_sizes = np.bincount(coverage_idx, weights=sizes, minlength=num_coverage_batches)
+        quantile_starts = np.cumsum(quantile_sizes) - quantile_sizes
+        counter = np.cumsum(ordered_sizes) - ordered_sizes - quantile_starts[ordered_coverage_idx]
+        wgd_idx = ((counter / quantile_sizes[ordered_coverage_idx]) * num_wgd_batches).astype(np.int64)
+        batch_idx = np.empty(len(order), dtype=np.int64)
+        batch_idx[order] = ordered_coverage_idx * num_wgd_batches + wgd_idx
+        return batch_idx
+
+    def _plan_batches(self, family_arrays, num_individuals, target_batch_size, num_coverage_quantiles, min_sex_count, use_sex_balancing):
+        plan = BatchPlan()
+        plan.target_batch_size = target_batch_size
+        plan.num_coverage_quantiles = self._get_num_coverage_quantiles(num_individuals, target_batch_size, num_coverage_quantiles)
+        plan.cohort_size = int(np.sum(family_arrays["sizes"]))
+        plan.num_wgd_batches = self._get_num_wgd_batches(plan.cohort_size, plan.num_coverage_quantiles, target_batch_size)
+        plan.num_batches = plan.num_coverage_quantiles * plan.num_wgd_batches
+        plan.min_sex_count = min_sex_count
+        plan.use_sex_balancing = use_sex_balancing
+        if plan.num_batches < 1:
+            plan.passes = False
+            return plan
+
+        if use_sex_balancing:
+            groups = [family_arrays["sex"] == x for x in np.unique(family_arrays["sex"])]
+        else:
+            groups = [None]
+        counts = {}
+        for name in ["sizes", "num_male", "num_female", "num_sex_other"]:
+            counts[name] = np.zeros(plan.num_batches, dtype=int)
+        for group in groups:
+            group_arrays = self._get_group_arrays(family_arrays, group)
+            batch_idx = self._predict_batch_indices(group_arrays, plan.num_coverage_quantiles, plan.num_wgd_batches)
+            for name in counts:
+                counts[name] += np.bincount(batch_idx, weights=group_arrays[name], minlength=plan.num_batches).astype(int)
+
+        plan.batch_sizes = counts["sizes"]
+        plan.batch_num_male = counts["num_male"]
+        plan.batch_num_female = counts["num_female"]
+        plan.batch_num_sex_other = counts["num_sex_other"]
+        plan.passes = bool(np.min(plan.batch_num_male) >= min_sex_count and np.min(plan.batch_num_female) >= min_sex_count)
+        return plan
+
+    # Returns parameter changes predicted to satisfy min_sex_count, one per strategy
+    def _suggest_parameters(self, family_arrays, num_individuals, plan, num_coverage_quantiles):
+        suggestions = []
+        if not plan.use_sex_balancing:
+            balanced_plan = self._plan_batches(family_arrays, num_individuals, plan.target_batch_size, num_coverage_quantiles, plan.min_sex_count, 1)
+            if balanced_plan.passes:
+                suggestions.append({"use_sex_balancing": 1})
+
+        # Smallest passing batch size found by doubling, then bisecting
+        low = plan.target_batch_size
+        high = None
+        size = plan.target_batch_size
+        while high is None and size < plan.cohort_size:
+            size = min(size * 2, plan.cohort_size)
+            if self._plan_batches(family_arrays, num_individuals, size, num_coverage_quantiles, plan.min_sex_count, plan.use_sex_balancing).passes:
+                high = size
+            else:
+                low = size
+        while high is not None and high - low > max(1, int(PLAN_SEARCH_TOLERANCE * high)):
+            size = (low + high) // 2
+            if self._plan_batches(family_arrays, num_individuals, size, num_coverage_quantiles, plan.min_sex_count, plan.use_sex_balancing).passes:
+                high = size
+            else:
+                low = size
+        if high is not None:
+            suggestions.append({"target_batch_size": high})
+
+        if plan.num_batches > 0:
+            max_min_sex_count = int(min(np.min(plan.batch_num_male), np.min(plan.batch_num_female)))
+            if max_min_sex_count > 0:
+                suggestions.append({"min_sex_count": max_min_sex_count})
+        return suggestions
+
+    # Predicts the batch layout that batch_cohort would produce without running it. Uses the same
+    # quantile and WGD batch count formulas, and suggests parameter changes if min_sex_count would fail.
+    def plan_cohort(self,
+                    target_batch_size=DEFAULT_BATCH_SIZE,
+                    num_coverage_quantiles=None,
+                    min_sex_count=DEFAULT_MIN_SEX_COUNT,
+                    use_sex_balancing=DEFAULT_SEX_BALANCED,
+                    ped_file_path=None,
+                    verbosity=DEFAULT_VERBOSITY):
+        if target_batch_size < MIN_TARGET_BATCH_SIZE:
+            printers.raise_error("Target batch size must be >= " + str(MIN_TARGET_BATCH_SIZE))
+        num_individuals = len(self.individuals_dict)
+        if ped_file_path or self.pedigree is not None:
+            self._build_families(ped_file_path)
+            family_arrays = self._get_family_arrays([x.proband for x in self.families], self.families)
+        else:
+            # Singleton families are not materialized
+            individuals = list(self.individuals_dict.values())
+            family_arrays = self._get_family_arrays(individuals)
+        plan = self._plan_batches(family_arrays, num_individuals, target_batch_size, num_coverage_quantiles, min_sex_count, use_sex_balancing)
+        plan.suggestions = [] if plan.passes else self._suggest_parameters(family_arrays, num_individuals, plan, num_coverage_quantiles)
+
+        if verbosity:
+            sys.stderr.write("################ Plan ################\n")
+            printers.print_parameter("Target batch size", plan.target_batch_size)
+            printers.print_parameter("Coverage quantiles", plan.num_coverage_quantiles)
+            printers.print_parameter("WGD batches per quantile", plan.num_wgd_batches)
+            printers.print_parameter("Cohort size", plan.cohort_size)
+            printers.print_parameter("Sex balancing", plan.use_sex_balancing)
+            printers.print_parameter("Predicted batches", plan.num_batches)
+            if plan.num_batches > 0:
+                printers.print_parameter("Predicted batch size (mean/std/min/max)", self._get_array_stats(plan.batch_sizes))
+                printers.print_parameter("Predicted batch males (mean/std/min/max)", self._get_array_stats(plan.batch_num_male))
+                printers.print_parameter("Predicted batch females (mean/std/min/max)", self._get_array_stats(plan.batch_num_female))
+                printers.print_parameter("Predicted batches below min sex count", plan.num_failing_batches())
+            printers.print_parameter("Predicted to pass", plan.passes)
+            for suggestion in plan.suggestions:
+                printers.print_parameter("Suggestion", ", ".join([x + "=" + str(suggestion[x]) for x in suggestion]))
+        return plan
+
+    # Yields (batch, stats) tuples as soon as each coverage quantile has been split. Checks that span
+    # all batches (min_sex_count, total size) are run once the last batch has been yielded.
+    def iter_batches(self,
+                     target_batch_size=DEFAULT_BATCH_SIZE,
+                     num_coverage_quantiles=None,
+                     min_sex_count=DEFAULT_MIN_SEX_COUNT,
+                     use_sex_balancing=DEFAULT_SEX_BALANCED,
+                     ped_file_path=None,
+                     verbosity=DEFAULT_VERBOSITY):
+        num_coverage_quantiles, num_wgd_batches, cohort_size = self._prepare_batching(target_batch_size, num_coverage_quantiles, use_sex_balancing, ped_file_path, verbosity)
+
+        # Run batching
+        if use_sex_balancing:
+            printers.print_warning("Sex balancing may result in poorer metric clustering.")
+            batches = self._iter_batches_sex_balanced(num_coverage_quantiles, num_wgd_batches)
+        else:
+            batches = self._iter_batches_not_sex_balanced(num_coverage_quantiles, num_wgd_batches)
+
+        # Assignments are only published once the batches pass the final checks
+        batch_stats = []
+        batch_indices = {}
+        self.batches = None
+        self.batch_indices = None
+        for batch in batches:
+            stats = self._get_batch_stats(batch)
+            batch_stats.append(stats)
+            for family in batch:
+                for individual in family.members:
+                    batch_indices[individual.id] = len(batch_stats) - 1
+            yield batch, stats
+
+        self._check_batch_stats(batch_stats, cohort_size, min_sex_count, verbosity)
+        self.batch_indices = batch_indices
+
+    def batch_cohort(self,
+                     target_batch_size=DEFAULT_BATCH_SIZE,
+                     num_coverage_quantiles=None,
+                     min_sex_count=DEFAULT_MIN_SEX_COUNT,
+                     use_sex_balancing=DEFAULT_SEX_BALANCED,
+                     ped_file_path=None,
+                     verbosity=DEFAULT_VERBOSITY):
+        batches = [batch for batch, stats in self.iter_batches(target_batch_size=target_batch_size,
+                                                               num_coverage_quantiles=num_coverage_quantiles,
+                                                               min_sex_count=min_sex_count,
+                                                               use_sex_balancing=use_sex_balancing,
+                                                               ped_file_path=ped_file_path,
+                                                               verbosity=verbosity)]
         self.batches = batches
         return batches
 
+    # Batches the cohort and writes each batch while the next ones are being computed. Batches are
+    # not retained in memory. Global constraint errors are raised after all batches are computed, in
+    # which case no batch files are left in output_dir.
+    def batch_cohort_and_write(self,
+                               output_dir,
+                               target_batch_size=DEFAULT_BATCH_SIZE,
+                               num_coverage_quantiles=None,
+                               min_sex_count=DEFAULT_MIN_SEX_COUNT,
+                               use_sex_balancing=DEFAULT_SEX_BALANCED,
+                               ped_file_path=None,
+                               verbosity=DEFAULT_VERBOSITY,
+                               write_queue_size=io.DEFAULT_WRITE_QUEUE_SIZE):
+        batches = self.iter_batches(target_batch_size=target_batch_size,
+                                    num_coverage_quantiles=num_coverage_quantiles,
+                                    min_sex_count=min_sex_count,
+                                    use_sex_balancing=use_sex_balancing,
+                                    ped_file_path=ped_file_path,
+                                    verbosity=verbosity)
+        return io.write_output_streaming((batch for batch, stats in batches), output_dir, queue_size=write_queue_size)
+
     def write_output(self, output_dir):
+        if self.batches is None:
+            printers.raise_error("No batches to write; run batch_cohort first")
         io.write_output(self.batches, output_dir)
@@ -97,3 +97,42 @@ class Family:
 
     def table_strings(self):
         return [self.id + "\t" + x.table_string() for x in self.members]
+
+
+class BatchStats:
+    def __init__(self):
+        self.size = None
+        self.num_male = None
+        self.num_female = None
+        self.num_sex_other = None
+        self.sex_ratio = None
+        self.coverage = None
+        self.wgd = None
+
+    def __repr__(self):
+        return "[" + ",".join([str(x) for x in [self.size, self.num_male, self.num_female, self.num_sex_other]]) + "]"
+
+
+class BatchPlan:
+    def __init__(self):
+        self.target_batch_size = None
+        self.num_coverage_quantiles = None
+        self.num_wgd_batches = None
+        self.num_batches = None
+        self.cohort_size = None
+        self.min_sex_count = None
+        self.use_sex_balancing = None
+        self.batch_sizes = None
+        self.batch_num_male = None
+        self.batch_num_female = None
+        self.batch_num_sex_other = None
+        self.passes = None
+        self.suggestions = None
+
+    def num_failing_batches(self):
+        if self.batch_sizes is None:
+            return self.num_batches
+        return len([i for i in range(self.num_batches) if self.batch_num_male[i] < self.min_sex_count or self.batch_num_female[i] < self.min_sex_count])
+
+    def __repr__(self):
+        return "[" + ",".join([str(x) for x in [self.num_batches, self.num_coverage_quantiles, self.num_wgd_batches, self.passes]]) + "]"
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+
+######################################################
+#
+# Benchmarks for cohort loading
+# Run with: python -m svbatcher.tests.benchmark
+#
+######################################################
+
+import svbatcher.tests.cohort_generator as generator
+import svbatcher.utils.bgzf as bgzf
+import svbatcher.utils.io as io
+import gzip
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+BENCHMARK_COHORT_SIZE = 2000000
+BENCHMARK_REPEATS = 3
+BENCHMARK_GZIP_PATH = "./svbatcher/tests/benchmark_coverage.gzip.tsv.gz"
+BENCHMARK_BGZF_PATH = "./svbatcher/tests/benchmark_coverage.bgzf.tsv.gz"
+BENCHMARK_GENERATOR_COHORT_SIZE = 10000000
+BENCHMARK_GENERATOR_NUM_SHARDS = 8
+BENCHMARK_GENERATOR_FAMILY_SIZE_PROBS = [0.4, 0.1, 0.3, 0.2]
+BENCHMARK_PED_FILE_NAME = "benchmark.ped"
+
+
+def _write_coverage_files(cohort_size):
+    sample_ids = ["sample_" + str(i) for i in range(cohort_size)]
+    coverage = [generator.COVERAGE_MIN + (i % 1000) * 0.03 for i in range(cohort_size)]
+    lines = [generator.COVERAGE_HEADER] + [sample_ids[i] + "\t" + str(coverage[i]) + "\n" for i in range(cohort_size)]
+    with gzip.open(BENCHMARK_GZIP_PATH, 'w') as f:
+        f.write("".join(lines))
+    with bgzf.BgzfWriter(BENCHMARK_BGZF_PATH) as f:
+        f.write("".join(lines))
+
+
+def _time_call(func):
+    times = []
+    for i in range(BENCHMARK_REPEATS):
+        start = time.time()
+        func()
+        times.append(time.time() - start)
+    return min(times)
+
+
+def _drain(f):
+    for line in f:
+        pass
+
+
+def bench_bgzf_reader(cohort_size=BENCHMARK_COHORT_SIZE):
+    _write_coverage_files(cohort_size)
+    try:
+        def gzip_read():
+            with gzip.open(BENCHMARK_BGZF_PATH, 'r') as f:
+                _drain(f)
+
+        def bgzf_read(num_threads):
+            with bgzf.BgzfReader(BENCHMARK_BGZF_PATH, num_threads=num_threads) as f:
+                _drain(f)
+
+        def gzip_load():
+            io.read_coverage_file(BENCHMARK_GZIP_PATH)
+
+        def bgzf_load():
+            io.read_coverage_file(BENCHMARK_BGZF_PATH)
+
+        results = [("Decompress, gzip.open", _time_call(gzip_read)),
+                   ("Decompress, BgzfReader (1 thread)", _time_call(lambda: bgzf_read(1))),
+                   ("Decompress, BgzfReader (" + str(bgzf.default_num_threads()) + " threads)", _time_call(lambda: bgzf_read(None))),
+                   ("read_coverage_file, plain gzip", _time_call(gzip_load)),
+                   ("read_coverage_file, bgzf", _time_call(bgzf_load))]
+        sys.stderr.write("Cohort size: " + str(cohort_size) + "\n")
+        for name, seconds in results:
+            sys.stderr.write(name + ": " + "%.3f" % seconds + " s\n")
+        return results
+    finally:
+        os.remove(BENCHMARK_GZIP_PATH)
+        os.remove(BENCHMARK_BGZF_PATH)
+
+
+def bench_cohort_generator(cohort_size=BENCHMARK_GENERATOR_COHORT_SIZE):
+    # Written to a private directory so that the test fixture files are left alone
+    output_dir = tempfile.mkdtemp()
+    results = []
+    try:
+        for bgzip in [False, True]:
+            start = time.time()
+            file_paths = generator.generate_and_write_files(cohort_size=cohort_size,
+                                                            num_shards=BENCHMARK_GENERATOR_NUM_SHARDS,
+                                                            bgzip=bgzip,
+                                                            family_size_probs=BENCHMARK_GENERATOR_FAMILY_SIZE_PROBS,
+                                                            ped_file_path=os.path.join(output_dir, BENCHMARK_PED_FILE_NAME),
+                                                            output_dir=output_dir)
+            results.append(("Generate cohort, bgzip=" + str(bgzip), time.time() - start))
+            generator.delete_files(file_paths)
+    finally:
+        shutil.rmtree(output_dir)
+    sys.stderr.write("Cohort size: " + str(cohort_size) + "\n")
+    for name, seconds in results:
+        sys.stderr.write(name + ": " + "%.3f" % seconds + " s\n")
+    return results
+
+
+if __name__ == "__main__":
+    bench_bgzf_reader()
+    bench_cohort_generator()
@@ -1,8 +1,21 @@
 #!/usr/bin/env python
 
+######################################################
+#
+# Synthetic cohort generator for tests and benchmarks
+#
+# Sample values are drawn with numpy, but rows are still formatted by Python's
+# %-operator (one operation per 64k-row block). Formatting dominates run time:
+# on a single core, 10M samples with 8 shards and a PED take roughly 30 s
+# uncompressed and 60 s bgzipped, short of the "10M in seconds" goal. Formatting
+# columns with numpy string conversion was measured and was not faster.
+#
+######################################################
+
 import svbatcher.tests.constants as const
+import svbatcher.utils.bgzf as bgzf
 import svbatcher.utils.io as io
-import random
+import numpy as np
 import os
 
 SEED = 0
@@ -21,6 +34,7 @@ WGD_MAX = 1.0
 SEX_MALE_STR = io.SEX_ASSIGNMENT_MALE_STRING
 SEX_FEMALE_STR = io.SEX_ASSIGNMENT_FEMALE_STRING
 SEX_OTHER_STR = "OTHER"
+SEX_STRINGS = np.array([SEX_MALE_STR, SEX_FEMALE_STR, SEX_OTHER_STR])
 
 PROB_MALE = 0.49
 PROB_FEMALE = 0.49
@@ -38,63 +52,175 @@ WGD_HEADER = "\t".join([io.HEADER_SYMBOL + io.WGD_SAMPLE_COLUMN_NAME, io.WGD_SCO
 SEX_HEADER = "\t".join([io.HEADER_SYMBOL + io.SEX_ASSIGNMENT_SAMPLE_COLUMN_NAME, "chrX.CN", "chrY.CN", io.SEX_ASSIGNMENT_SEX_COLUMN_NAME, "pMos.X", "pMos.Y", "qMos.X", "qMos.Y"]) + "\n"
 EMPTY_FIELD_STR = "na"
 
-
-def get_random_sex():
-    r = random.random()
-    if r < PROB_MALE:
-        return SEX_MALE_STR
-    if r < PROB_FEMALE + PROB_MALE:
-        return SEX_FEMALE_STR
-    return SEX_OTHER_STR
-
-
-def generate_data():
-    random.seed(SEED)
-    sample_ids = []
-    coverage = []
-    wgd = []
-    sex = []
-    for i in range(COHORT_SIZE):
-        sample_ids.append("sample_" + str(i))
-        coverage.append(random.uniform(COVERAGE_MIN, COVERAGE_MAX))
-        wgd.append(random.uniform(WGD_MIN, WGD_MAX))
-        sex.append(get_random_sex())
+SAMPLE_ID_FORMAT = "sample_%d"
+METRIC_FORMAT = "%.6f"
+FAMILY_ID_FORMAT = "family_%d"
+
+# Family size distribution: FAMILY_SIZE_PROBS[i] is the probability of a family with i+1 members
+SINGLETON_FAMILY_SIZE_PROBS = [1.0]
+PED_MISSING_PARENT = "0"
+PED_SEX_MALE = "1"
+PED_SEX_FEMALE = "2"
+PED_SEX_OTHER = "0"
+PED_SEX_STRINGS = np.array([PED_SEX_MALE, PED_SEX_FEMALE, PED_SEX_OTHER])
+PED_NOT_PROBAND_VALUE = "1"
+PED_PHENOTYPE_STRINGS = np.array([PED_NOT_PROBAND_VALUE, io.PED_PROBAND_VALUE])
+
+# Number of rows formatted per write
+WRITE_BLOCK_SIZE = 65536
+
+
+def get_random_sex(random_state, size):
+    r = random_state.random_sample(size)
+    sex = np.full(size, 2, dtype=np.int8)
+    sex[r < PROB_FEMALE + PROB_MALE] = 1
+    sex[r < PROB_MALE] = 0
+    return sex
+
+
+def generate_data(cohort_size=COHORT_SIZE, seed=SEED):
+    random_state = np.random.RandomState(seed)
+    sample_ids = np.arange(cohort_size)
+    coverage = random_state.uniform(COVERAGE_MIN, COVERAGE_MAX, cohort_size)
+    wgd = random_state.uniform(WGD_MIN, WGD_MAX, cohort_size)
+    sex = get_random_sex(random_state, cohort_size)
     return sample_ids, coverage, wgd, sex
 
 
+# Returns the family index of each sample and whether it is the family proband (its first member)
+def generate_families(cohort_size, family_size_probs, seed=SEED):
+    random_state = np.random.RandomState(seed + 1)
+    family_size_probs = np.asarray(family_size_probs, dtype=float)
+    family_size_probs /= family_size_probs.sum()
+    mean_family_size = np.dot(np.arange(1, len(family_size_probs) + 1), family_size_probs)
+    family_sizes = np.zeros(0, dtype=int)
+    while family_sizes.sum() < cohort_size:
+        num_draws = int((cohort_size - family_sizes.sum()) / mean_family_size) + 1
+        family_sizes = np.concatenate([family_sizes, random_state.choice(len(family_size_probs), num_draws, p=family_size_probs) + 1])
+    family_ends = np.cumsum(family_sizes)
+    num_families = np.searchsorted(family_ends, cohort_size) + 1
+    family_sizes = family_sizes[:num_families]
+    family_sizes[-1] -= family_ends[num_families - 1] - cohort_size
+    family_ids = np.repeat(np.arange(num_families), family_sizes)
+    is_proband = np.zeros(cohort_size, dtype=bool)
+    is_proband[np.cumsum(family_sizes) - family_sizes] = True
+    return family_ids, is_proband
+
+
+def _open_output(file_path):
+    return bgzf.BgzfWriter(file_path) if file_path.endswith('.gz') else open(file_path, 'w')
+
+
+# Formats rows with a single %-operation per block so that no per-row Python string handling is needed
+def _write_rows(f, row_format, columns, block_size=WRITE_BLOCK_SIZE):
+    num_rows = len(columns[0])
+    num_columns = len(columns)
+    for start in range(0, num_rows, block_size):
+        end = min(start + block_size, num_rows)
+        values = np.empty((end - start) * num_columns, dtype=object)
+        for i in range(num_columns):
+            values[i::num_columns] = columns[i][start:end].tolist()
+        f.write((row_format * (end - start)) % tuple(values.tolist()))
+
+
+def _get_row_format(num_fields, value_field, value_format):
+    fields = [SAMPLE_ID_FORMAT] + [EMPTY_FIELD_STR] * (num_fields - 1)
+    fields[value_field] = value_format
+    return "\t".join(fields) + "\n"
+
+
 def write_list(file_path, list):
     with open(file_path, 'w') as f:
         for item in list:
             f.write(item + "\n")
 
 
-def write_tsv(file_path, sample_ids, values, num_fields, value_field, header):
-    with open(file_path, 'w') as f:
+def write_tsv(file_path, sample_ids, values, num_fields, value_field, header, value_format=METRIC_FORMAT):
+    with _open_output(file_path) as f:
         f.write(header)
-        for i in range(len(sample_ids)):
-            fields = []
-            for j in range(num_fields):
-                if j == 0:
-                    fields.append(sample_ids[i])
-                elif j == value_field:
-                    fields.append(str(values[i]))
-                else:
-                    fields.append(EMPTY_FIELD_STR)
-            f.write("\t".join(fields) + "\n")
-
-
-def generate_and_write_files():
-    sample_ids, coverage, wgd, sex = generate_data()
-    write_list(WGD_FILE_LIST_PATH, [WGD_FILE_PATH])
-    write_list(SEX_FILE_LIST_PATH, [SEX_FILE_PATH])
-    write_tsv(COVERAGE_FILE_PATH, sample_ids, coverage, NUM_COVERAGE_FIELDS, COVERAGE_VALUE_FIELD, COVERAGE_HEADER)
-    write_tsv(WGD_FILE_PATH, sample_ids, wgd, NUM_WGD_FIELDS, WGD_VALUE_FIELD, WGD_HEADER)
-    write_tsv(SEX_FILE_PATH, sample_ids, sex, NUM_SEX_FIELDS, SEX_VALUE_FIELD, SEX_HEADER)
-
-
-def delete_files():
-    os.remove(WGD_FILE_LIST_PATH)
-    os.remove(SEX_FILE_LIST_PATH)
-    os.remove(COVERAGE_FILE_PATH)
-    os.remove(WGD_FILE_PATH)
-    os.remove(SEX_FILE_PATH)
+        _write_rows(f, _get_row_format(num_fields, value_field, value_format), [sample_ids, values])
+
+
+def write_ped(file_path, sample_ids, family_ids, is_proband, sex):
+    row_format = "\t".join([FAMILY_ID_FORMAT, SAMPLE_ID_FORMAT, PED_MISSING_PARENT, PED_MISSING_PARENT, "%s", "%s"]) + "\n"
+    with _open_output(file_path) as f:
+        _write_rows(f, row_format, [family_ids, sample_ids, PED_SEX_STRINGS[sex], PED_PHENOTYPE_STRINGS[is_proband.astype(int)]])
+
+
+# Places a default file path in output_dir, if given
+def get_output_path(file_path, output_dir=None):
+    if output_dir is None:
+        return file_path
+    return os.path.join(output_dir, os.path.basename(file_path))
+
+
+def get_shard_paths(file_path, num_shards, bgzip):
+    suffix = ".gz" if bgzip else ""
+    if num_shards == 1:
+        return [file_path + suffix]
+    base, ext = os.path.splitext(file_path)
+    return [base + "." + str(i) + ext + suffix for i in range(num_shards)]
+
+
+# Splits samples across shards. Missing samples are left out of every shard; duplicated samples
+# are written a second time to the following shard.
+def _get_shard_indices(cohort_size, num_shards, missing_fraction, duplicate_fraction, random_state):
+    present = np.flatnonzero(random_state.random_sample(cohort_size) >= missing_fraction)
+    duplicated = present[random_state.random_sample(len(present)) < duplicate_fraction]
+    shards = np.array_split(present, num_shards)
+    shard_of_sample = np.repeat(np.arange(num_shards), [len(x) for x in shards])
+    duplicate_shard = (shard_of_sample[np.searchsorted(present, duplicated)] + 1) % num_shards
+    return [np.concatenate([shards[i], duplicated[duplicate_shard == i]]) for i in range(num_shards)]
+
+
+def write_sharded_tsvs(file_path, sample_ids, values, num_fields, value_field, header, num_shards=1, bgzip=False,
+                       missing_fraction=0.0, duplicate_fraction=0.0, value_format=METRIC_FORMAT, seed=SEED):
+    random_state = np.random.RandomState(seed)
+    shard_paths = get_shard_paths(file_path, num_shards, bgzip)
+    shard_indices = _get_shard_indices(len(sample_ids), num_shards, missing_fraction, duplicate_fraction, random_state)
+    for i in range(num_shards):
+        indices = shard_indices[i]
+        write_tsv(shard_paths[i], sample_ids[indices], values[indices], num_fields, value_field, header, value_format=value_format)
+    return shard_paths
+
+
+# Writes the cohort files and returns a list of all paths written. With the default arguments this
+# writes single, uncompressed coverage, sex and WGD files without a pedigree to the test fixture
+# paths; output_dir writes the same file names to another directory.
+def generate_and_write_files(cohort_size=COHORT_SIZE,
+                             seed=SEED,
+                             num_shards=1,
+                             bgzip=False,
+                             family_size_probs=None,
+                             ped_file_path=None,
+                             missing_fraction=0.0,
+                             duplicate_fraction=0.0,
+                             output_dir=None):
+    sample_ids, coverage, wgd, sex = generate_data(cohort_size=cohort_size, seed=seed)
+    coverage_path = get_output_path(COVERAGE_FILE_PATH, output_dir) + (".gz" if bgzip else "")
+    write_tsv(coverage_path, sample_ids, coverage, NUM_COVERAGE_FIELDS, COVERAGE_VALUE_FIELD, COVERAGE_HEADER)
+    wgd_paths = write_sharded_tsvs(get_output_path(WGD_FILE_PATH, output_dir), sample_ids, wgd, NUM_WGD_FIELDS, WGD_VALUE_FIELD, WGD_HEADER,
+                                   num_shards=num_shards, bgzip=bgzip, missing_fraction=missing_fraction,
+                                   duplicate_fraction=duplicate_fraction, seed=seed + 2)
+    sex_paths = write_sharded_tsvs(get_output_path(SEX_FILE_PATH, output_dir), sample_ids, SEX_STRINGS[sex], NUM_SEX_FIELDS, SEX_VALUE_FIELD, SEX_HEADER,
+                                   num_shards=num_shards, bgzip=bgzip, missing_fraction=missing_fraction,
+                                   duplicate_fraction=duplicate_fraction, value_format="%s", seed=seed + 3)
+    wgd_list_path = get_output_path(WGD_FILE_LIST_PATH, output_dir)
+    sex_list_path = get_output_path(SEX_FILE_LIST_PATH, output_dir)
+    write_list(wgd_list_path, wgd_paths)
+    write_list(sex_list_path, sex_paths)
+    file_paths = [wgd_list_path, sex_list_path, coverage_path] + wgd_paths + sex_paths
+    if ped_file_path is not None:
+        if family_size_probs is None:
+            family_size_probs = SINGLETON_FAMILY_SIZE_PROBS
+        family_ids, is_proband = generate_families(cohort_size, family_size_probs, seed=seed)
+        write_ped(ped_file_path, sample_ids, family_ids, is_proband, sex)
+        file_paths.append(ped_file_path)
+    return file_paths
+
+
+def delete_files(file_paths=None):
+    if file_paths is None:
+        file_paths = [WGD_FILE_LIST_PATH, SEX_FILE_LIST_PATH, COVERAGE_FILE_PATH, WGD_FILE_PATH, SEX_FILE_PATH]
+    for file_path in file_paths:
+        os.remove(file_path)
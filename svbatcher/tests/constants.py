@@ -16,3 +16,11 @@ TEST_MIN_ACCEPTABLE_BATCHES = 48
 TEST_MAX_ACCEPTABLE_BATCHES = 52
 TEST_MIN_ACCEPTABLE_BATCH_SIZE = 198
 TEST_MAX_ACCEPTABLE_BATCH_SIZE = 202
+BGZF_COVERAGE_FILE_PATH = "./svbatcher/tests/test_coverage.tsv.gz"
+PED_FILE_PATH = "./svbatcher/tests/test.ped"
+
+TEST_STRESS_COHORT_SIZE = 50000
+TEST_STRESS_NUM_SHARDS = 4
+TEST_STRESS_FAMILY_SIZE_PROBS = [0.4, 0.1, 0.3, 0.2]
+TEST_STRESS_MISSING_FRACTION = 0.001
+TEST_STRESS_DUPLICATE_FRACTION = 0.01
@@ -2,27 +2,273 @@
 
 from unittest import TestCase
 from svbatcher.batcher import SVBatcher
-from svbatcher.data_types import Individual, Family
+from svbatcher.data_types import Individual, Family, BatchStats, BatchPlan
 import svbatcher.tests.cohort_generator as generator
+import svbatcher.utils.bgzf as bgzf
+import svbatcher.utils.io as io
 import constants as const
 import os
 import glob
+import gzip
+import array
+import numpy as np
 
 
 class TestSVBatcher(TestCase):
     def setUp(self):
-        generator.generate_and_write_files()
+        self.file_paths = generator.generate_and_write_files()
         if not os.path.exists(const.OUT_DIR_PATH):
             os.makedirs(const.OUT_DIR_PATH)
 
     def tearDown(self):
-        generator.delete_files()
+        generator.delete_files(set(self.file_paths))
         out_glob_path = os.path.join(const.OUT_DIR_PATH, "batch.*.txt")
         out_files = list(glob.iglob(out_glob_path))
         for filepath in out_files:
             os.remove(filepath)
         os.rmdir(const.OUT_DIR_PATH)
+        if os.path.exists(const.BGZF_COVERAGE_FILE_PATH):
+            os.remove(const.BGZF_COVERAGE_FILE_PATH)
 
+    def bgzf_test_reader(self):
+        with open(const.COVERAGE_FILE_PATH, 'r') as f:
+            expected_lines = f.readlines()
+        with bgzf.BgzfWriter(const.BGZF_COVERAGE_FILE_PATH) as f:
+            for line in expected_lines:
+                f.write(line)
+        self.assertTrue(bgzf.is_bgzf(const.BGZF_COVERAGE_FILE_PATH))
+        with gzip.open(const.BGZF_COVERAGE_FILE_PATH, 'r') as f:
+            self.assertEqual(f.readlines(), expected_lines)
+        for num_threads in [1, 4]:
+            with bgzf.BgzfReader(const.BGZF_COVERAGE_FILE_PATH, num_threads=num_threads, blocks_per_thread=1) as f:
+                self.assertEqual(f.readline(), expected_lines[0])
+                self.assertEqual(list(f), expected_lines[1:])
+            with bgzf.BgzfReader(const.BGZF_COVERAGE_FILE_PATH, num_threads=num_threads, blocks_per_thread=1) as f:
+                lines = []
+                line = f.readline()
+                while line:
+                    lines.append(line)
+                    line = f.readline()
+                self.assertEqual(lines, expected_lines)
+
+        expected_cohort = io.read_coverage_file(const.COVERAGE_FILE_PATH)
+        cohort = io.read_coverage_file(const.BGZF_COVERAGE_FILE_PATH)
+        self.assertEqual(len(cohort), len(expected_cohort))
+        for sample_id in expected_cohort:
+            self.assertEqual(cohort[sample_id].coverage, expected_cohort[sample_id].coverage)
+
+    def generator_test_stress(self):
+        data = generator.generate_data(cohort_size=const.TEST_STRESS_COHORT_SIZE)
+        for x, y in zip(data, generator.generate_data(cohort_size=const.TEST_STRESS_COHORT_SIZE)):
+            self.assertTrue((x == y).all())
+
+        self.file_paths.extend(generator.generate_and_write_files(cohort_size=const.TEST_STRESS_COHORT_SIZE,
+                                                                  num_shards=const.TEST_STRESS_NUM_SHARDS,
+                                                                  bgzip=True,
+                                                                  family_size_probs=const.TEST_STRESS_FAMILY_SIZE_PROBS,
+                                                                  ped_file_path=const.PED_FILE_PATH,
+                                                                  duplicate_fraction=const.TEST_STRESS_DUPLICATE_FRACTION))
+        with open(const.SEX_FILE_LIST_PATH, 'r') as f:
+            self.assertEqual(len(f.readlines()), const.TEST_STRESS_NUM_SHARDS)
+        batcher = SVBatcher()
+        cohort = batcher.load_cohort(const.BGZF_COVERAGE_FILE_PATH, const.SEX_FILE_LIST_PATH, const.WGD_FILE_LIST_PATH)
+        self.assertEqual(len(cohort), const.TEST_STRESS_COHORT_SIZE)
+        batches = batcher.batch_cohort(target_batch_size=const.TEST_TARGET_BATCH_SIZE,
+                                       min_sex_count=0,
+                                       ped_file_path=const.PED_FILE_PATH,
+                                       verbosity=0)
+        self.assertEqual(sum([sum([x.size() for x in y]) for y in batches]), const.TEST_STRESS_COHORT_SIZE)
+        self.assertEqual(max([x.size() for x in batcher.families]), len(const.TEST_STRESS_FAMILY_SIZE_PROBS))
+
+        # Samples missing from the sex and WGD files leave individuals undefined
+        self.file_paths.extend(generator.generate_and_write_files(cohort_size=const.TEST_STRESS_COHORT_SIZE,
+                                                                  num_shards=const.TEST_STRESS_NUM_SHARDS,
+                                                                  missing_fraction=const.TEST_STRESS_MISSING_FRACTION))
+        batcher.load_cohort(const.COVERAGE_FILE_PATH, const.SEX_FILE_LIST_PATH, const.WGD_FILE_LIST_PATH)
+        with self.assertRaises(ValueError):
+            batcher.batch_cohort(target_batch_size=const.TEST_TARGET_BATCH_SIZE, verbosity=0)
+
+    def arrays_test_batches(self):
+        self.file_paths.extend(generator.generate_and_write_files(family_size_probs=const.TEST_STRESS_FAMILY_SIZE_PROBS,
+                                                                  ped_file_path=const.PED_FILE_PATH))
+        file_batcher = SVBatcher()
+        cohort = file_batcher.load_cohort(const.COVERAGE_FILE_PATH, const.SEX_FILE_LIST_PATH, const.WGD_FILE_LIST_PATH)
+        expected_batches = file_batcher.batch_cohort(target_batch_size=const.TEST_TARGET_BATCH_SIZE,
+                                                     min_sex_count=0,
+                                                     ped_file_path=const.PED_FILE_PATH,
+                                                     verbosity=0)
+
+        sample_ids = sorted(cohort.keys())
+        sex_strings = {Individual.MALE_CHAR: io.SEX_ASSIGNMENT_MALE_STRING, Individual.FEMALE_CHAR: io.SEX_ASSIGNMENT_FEMALE_STRING, Individual.SEX_OTHER_CHAR: generator.SEX_OTHER_STR}
+        with open(const.PED_FILE_PATH, 'r') as f:
+            ped_tokens = [line.strip().split('\t') for line in f]
+        batcher = SVBatcher()
+        cohort_arrays = batcher.load_cohort_arrays(sample_ids,
+                                                   array.array('d', [cohort[x].coverage for x in sample_ids]),
+                                                   [sex_strings[cohort[x].sex_char()] for x in sample_ids],
+                                                   np.array([cohort[x].wgd for x in sample_ids]),
+                                                   ped_family_ids=[x[io.PED_FAMILY_ID_COLUMN] for x in ped_tokens],
+                                                   ped_proband=[x[io.PED_PROBAND_COLUMN] for x in ped_tokens],
+                                                   ped_sample_ids=[x[io.PED_SAMPLE_ID_COLUMN] for x in ped_tokens])
+        self.assertEqual(len(cohort_arrays), len(cohort))
+        for sample_id in cohort:
+            self.assertEqual(cohort_arrays[sample_id].sex, cohort[sample_id].sex)
+        batches = batcher.batch_cohort(target_batch_size=const.TEST_TARGET_BATCH_SIZE,
+                                       min_sex_count=0,
+                                       verbosity=0)
+        self.assertEqual([[x.id for x in y] for y in batches], [[x.id for x in y] for y in expected_batches])
+
+        assignments = batcher.get_batch_assignments()
+        self.assertIsInstance(assignments, np.ndarray)
+        self.assertEqual(len(assignments), len(sample_ids))
+        sample_assignments = dict(zip(sample_ids, assignments))
+        for i in range(len(batches)):
+            for family in batches[i]:
+                for individual in family.members:
+                    self.assertEqual(sample_assignments[individual.id], i)
+        self.assertEqual(list(batcher.get_batch_assignments(["not_a_sample"])), [-1])
+        self.assertEqual(sum([x.size() for x in batcher.families]), len(sample_ids))
+        for family in batcher.families:
+            self.assertEqual(len([x for x in family.members if x.is_proband()]), 1)
+
+        # The streaming path records assignments too
+        batcher.batch_cohort_and_write(const.OUT_DIR_PATH,
+                                       target_batch_size=const.TEST_TARGET_BATCH_SIZE,
+                                       min_sex_count=0,
+                                       verbosity=0)
+        self.assertEqual(list(batcher.get_batch_assignments()), list(assignments))
+
+        # A run failing the final checks leaves no assignments behind
+        with self.assertRaises(ValueError):
+            batcher.batch_cohort(target_batch_size=const.TEST_TARGET_BATCH_SIZE,
+                                 min_sex_count=const.TEST_TARGET_BATCH_SIZE,
+                                 verbosity=0)
+        with self.assertRaises(ValueError):
+            batcher.get_batch_assignments()
+
+        # Reloading discards the previous batches
+        batcher.load_cohort_arrays(sample_ids,
+                                   [cohort[x].coverage for x in sample_ids],
+                                   [sex_strings[cohort[x].sex_char()] for x in sample_ids],
+                                   [cohort[x].wgd for x in sample_ids])
+        self.assertIs(batcher.batches, None)
+        self.assertIs(batcher.families, None)
+        with self.assertRaises(ValueError):
+            batcher.get_batch_assignments()
+
+        with self.assertRaises(ValueError):
+            batcher.load_cohort_arrays(sample_ids, [], [], [])
+        with self.assertRaises(ValueError):
+            batcher.load_cohort_arrays(sample_ids[:1], [1.0], [io.SEX_ASSIGNMENT_MALE_STRING], [0.0],
+                                       ped_family_ids=["family"], ped_proband=[2.0])
+
+        # Integer phenotype codes are accepted like their string forms
+        for ped_proband in [[1, 2], np.array([2, 1])]:
+            self.assertEqual(list(io.get_proband_flags(ped_proband)), [x == 2 for x in ped_proband])
+        self.assertEqual(list(io.get_proband_flags([0, 1])), [False, False])
+        batcher.load_cohort_arrays(sample_ids[:2], [1.0, 1.0], [io.SEX_ASSIGNMENT_MALE_STRING] * 2, [0.0, 0.0],
+                                   ped_family_ids=["family", "family"], ped_proband=np.array([1, 2]))
+        batcher.batch_cohort(target_batch_size=2, min_sex_count=0, verbosity=0)
+        self.assertEqual([x.id for x in batcher.families[0].members if x.is_proband()], [sample_ids[1]])
+
+    def streaming_test_batches(self):
+        batcher = SVBatcher()
+        batcher.load_cohort(const.COVERAGE_FILE_PATH, const.SEX_FILE_LIST_PATH, const.WGD_FILE_LIST_PATH)
+        for use_sex_balancing in [1, 0]:
+            expected_batches = batcher.batch_cohort(target_batch_size=const.TEST_TARGET_BATCH_SIZE,
+                                                    num_coverage_quantiles=const.TEST_COVERAGE_QUANTILES,
+                                                    use_sex_balancing=use_sex_balancing,
+                                                    verbosity=0)
+            batches = []
+            for batch, stats in batcher.iter_batches(target_batch_size=const.TEST_TARGET_BATCH_SIZE,
+                                                     num_coverage_quantiles=const.TEST_COVERAGE_QUANTILES,
+                                                     use_sex_balancing=use_sex_balancing,
+                                                     verbosity=0):
+                self.assertIsInstance(stats, BatchStats)
+                self.assertEqual(stats.size, sum([x.size() for x in batch]))
+                self.assertEqual(stats.num_male + stats.num_female + stats.num_sex_other, stats.size)
+                batches.append(batch)
+            self.assertEqual([[x.id for x in y] for y in batches], [[x.id for x in y] for y in expected_batches])
+
+        num_batches = batcher.batch_cohort_and_write(const.OUT_DIR_PATH,
+                                                     target_batch_size=const.TEST_TARGET_BATCH_SIZE,
+                                                     num_coverage_quantiles=const.TEST_COVERAGE_QUANTILES,
+                                                     verbosity=0,
+                                                     write_queue_size=1)
+        self.assertEqual(num_batches, len(expected_batches))
+        for i in range(num_batches):
+            with open(os.path.join(const.OUT_DIR_PATH, "batch." + str(i) + ".txt"), 'r') as f:
+                lines = f.readlines()
+            self.assertEqual(len(lines) - 1, sum([x.size() for x in expected_batches[i]]))
+            os.remove(os.path.join(const.OUT_DIR_PATH, "batch." + str(i) + ".txt"))
+        self.assertIs(batcher.batches, None)
+        with self.assertRaises(ValueError):
+            batcher.write_output(const.OUT_DIR_PATH)
+
+        # A run failing the final checks leaves no batch files behind
+        with self.assertRaises(ValueError):
+            batcher.batch_cohort_and_write(const.OUT_DIR_PATH,
+                                           target_batch_size=const.TEST_TARGET_BATCH_SIZE,
+                                           num_coverage_quantiles=const.TEST_COVERAGE_QUANTILES,
+                                           min_sex_count=const.TEST_TARGET_BATCH_SIZE,
+                                           verbosity=0)
+        self.assertEqual(os.listdir(const.OUT_DIR_PATH), [])
+
+        with self.assertRaises(ValueError):
+            for batch, stats in batcher.iter_batches(target_batch_size=const.TEST_TARGET_BATCH_SIZE,
+                                                     num_coverage_quantiles=const.TEST_COVERAGE_QUANTILES,
+                                                     min_sex_count=const.TEST_TARGET_BATCH_SIZE,
+                                                     verbosity=0):
+                pass
+
+    def plan_test_batches(self):
+        self.file_paths.extend(generator.generate_and_write_files(family_size_probs=const.TEST_STRESS_FAMILY_SIZE_PROBS,
+                                                                  ped_file_path=const.PED_FILE_PATH))
+        batcher = SVBatcher()
+        for tied_metrics in [False, True]:
+            cohort = batcher.load_cohort(const.COVERAGE_FILE_PATH, const.SEX_FILE_LIST_PATH, const.WGD_FILE_LIST_PATH)
+            # Rounded metrics produce ties, which batching breaks by sort order
+            if tied_metrics:
+                for individual in cohort.values():
+                    individual.coverage = round(individual.coverage)
+                    individual.wgd = round(individual.wgd, 1)
+            for ped_file_path in [None, const.PED_FILE_PATH]:
+                for use_sex_balancing in [0, 1]:
+                    plan = batcher.plan_cohort(target_batch_size=const.TEST_TARGET_BATCH_SIZE,
+                                               num_coverage_quantiles=const.TEST_COVERAGE_QUANTILES,
+                                               min_sex_count=0,
+                                               use_sex_balancing=use_sex_balancing,
+                                               ped_file_path=ped_file_path,
+                                               verbosity=0)
+                    self.assertIsInstance(plan, BatchPlan)
+                    self.assertTrue(plan.passes)
+                    self.assertFalse(plan.suggestions)
+                    batches = batcher.batch_cohort(target_batch_size=const.TEST_TARGET_BATCH_SIZE,
+                                                   num_coverage_quantiles=const.TEST_COVERAGE_QUANTILES,
+                                                   min_sex_count=0,
+                                                   use_sex_balancing=use_sex_balancing,
+                                                   ped_file_path=ped_file_path,
+                                                   verbosity=0)
+                    self.assertEqual(plan.num_batches, len(batches))
+                    self.assertEqual(list(plan.batch_sizes), [sum([x.size() for x in y]) for y in batches])
+                    self.assertEqual(list(plan.batch_num_male), [sum([x.num_male() for x in y]) for y in batches])
+                    self.assertEqual(list(plan.batch_num_female), [sum([x.num_female() for x in y]) for y in batches])
+
+        batcher.load_cohort(const.COVERAGE_FILE_PATH, const.SEX_FILE_LIST_PATH, const.WGD_FILE_LIST_PATH)
+        plan = batcher.plan_cohort(target_batch_size=const.TEST_TARGET_BATCH_SIZE,
+                                   num_coverage_quantiles=const.TEST_COVERAGE_QUANTILES,
+                                   min_sex_count=const.TEST_TARGET_BATCH_SIZE / 2,
+                                   verbosity=0)
+        self.assertFalse(plan.passes)
+        self.assertTrue(plan.num_failing_batches() > 0)
+        self.assertTrue(plan.suggestions)
+        for suggestion in plan.suggestions:
+            params = {"target_batch_size": const.TEST_TARGET_BATCH_SIZE,
+                      "num_coverage_quantiles": const.TEST_COVERAGE_QUANTILES,
+                      "min_sex_count": const.TEST_TARGET_BATCH_SIZE / 2,
+                      "verbosity": 0}
+            params.update(suggestion)
+            self.assertTrue(batcher.batch_cohort(**params))
 
     def integration_test_individuals(self):
         batcher = SVBatcher()
@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+
+######################################################
+#
+# Blocked gzip (BGZF) read/write utils
+#
+######################################################
+
+from svbatcher.utils import printers
+from multiprocessing.pool import ThreadPool
+import multiprocessing
+import struct
+import zlib
+
+# BGZF block layout (see the SAM/BAM specification, section 4.1)
+GZIP_MAGIC = b'\x1f\x8b'
+GZIP_CM_DEFLATE = 8
+GZIP_FLG_FEXTRA = 4
+BGZF_HEADER_SIZE = 18
+BGZF_FIXED_HEADER_SIZE = 12
+BGZF_FOOTER_SIZE = 8
+BGZF_SUBFIELD_ID = b'BC'
+BGZF_SUBFIELD_LENGTH = 2
+BGZF_MAX_BLOCK_DATA_SIZE = 65280
+BGZF_BLOCK_HEADER = b'\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00'
+BGZF_EOF_BLOCK = b'\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00\x1b\x00\x03\x00\x00\x00\x00\x00\x00\x00\x00\x00'
+
+# Number of compressed blocks handed to the thread pool per thread at a time.
+# Bounds memory to roughly threads * BLOCKS_PER_THREAD * 64KB of decompressed data.
+DEFAULT_BLOCKS_PER_THREAD = 16
+DEFAULT_COMPRESSION_LEVEL = 6
+
+
+def default_num_threads():
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
+
+
+def _parse_block_size(header):
+    if len(header) < BGZF_HEADER_SIZE or header[0:2] != GZIP_MAGIC:
+        return None
+    cm, flg = struct.unpack('<BB', header[2:4])
+    if cm != GZIP_CM_DEFLATE or not flg & GZIP_FLG_FEXTRA:
+        return None
+    xlen, = struct.unpack('<H', header[10:12])
+    if xlen < 6 or header[12:14] != BGZF_SUBFIELD_ID:
+        return None
+    slen, = struct.unpack('<H', header[14:16])
+    if slen != BGZF_SUBFIELD_LENGTH:
+        return None
+    bsize, = struct.unpack('<H', header[16:18])
+    return bsize + 1
+
+
+def is_bgzf(file_path):
+    with open(file_path, 'rb') as f:
+        header = f.read(BGZF_HEADER_SIZE)
+    return _parse_block_size(header) is not None
+
+
+# Returns the raw deflate payload, crc and uncompressed size of the next block, or None at end of file
+def _read_raw_block(f):
+    header = f.read(BGZF_FIXED_HEADER_SIZE)
+    if not header:
+        return None
+    if len(header) < BGZF_FIXED_HEADER_SIZE or header[0:2] != GZIP_MAGIC:
+        printers.raise_error("Invalid BGZF block header in " + str(f.name))
+    xlen, = struct.unpack('<H', header[10:12])
+    extra = f.read(xlen)
+    block_size = None
+    pos = 0
+    while pos + 4 <= len(extra):
+        subfield_id = extra[pos:pos + 2]
+        subfield_length, = struct.unpack('<H', extra[pos + 2:pos + 4])
+        if subfield_id == BGZF_SUBFIELD_ID and subfield_length == BGZF_SUBFIELD_LENGTH:
+            block_size, = struct.unpack('<H', extra[pos + 4:pos + 6])
+            block_size += 1
+        pos += 4 + subfield_length
+    if block_size is None:
+        printers.raise_error("BGZF block is missing the BC subfield in " + str(f.name))
+    remainder_size = block_size - BGZF_FIXED_HEADER_SIZE - xlen
+    remainder = f.read(remainder_size)
+    if len(remainder) != remainder_size:
+        printers.raise_error("Truncated BGZF block in " + str(f.name))
+    crc, isize = struct.unpack('<II', remainder[-BGZF_FOOTER_SIZE:])
+    return remainder[:-BGZF_FOOTER_SIZE], crc, isize
+
+
+def _inflate_block(raw_block):
+    cdata, crc, isize = raw_block
+    data = zlib.decompress(cdata, -zlib.MAX_WBITS)
+    if len(data) != isize or (zlib.crc32(data) & 0xffffffff) != crc:
+        printers.raise_error("BGZF block failed integrity check")
+    return data
+
+
+def _deflate_block(data, level=DEFAULT_COMPRESSION_LEVEL):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    cdata = compressor.compress(data) + compressor.flush()
+    block_size = len(BGZF_BLOCK_HEADER) + 2 + len(cdata) + BGZF_FOOTER_SIZE
+    return BGZF_BLOCK_HEADER + struct.pack('<H', block_size - 1) + cdata + \
+        struct.pack('<II', zlib.crc32(data) & 0xffffffff, len(data))
+
+
+# Read-only file object over a BGZF file. Blocks are inflated in parallel by a thread pool and
+# returned in file order, so iteration yields the same lines as gzip.open().
+class BgzfReader:
+    def __init__(self, file_path, num_threads=None, blocks_per_thread=DEFAULT_BLOCKS_PER_THREAD):
+        if num_threads is None:
+            num_threads = default_num_threads()
+        self.name = file_path
+        self.closed = False
+        self._file = open(file_path, 'rb')
+        self._pool = ThreadPool(num_threads) if num_threads > 1 else None
+        self._chunk_size = max(num_threads, 1) * blocks_per_thread
+        self._blocks = self._iter_blocks()
+        self._buffer = b''
+        self._offset = 0
+
+    def _read_raw_chunk(self):
+        chunk = []
+        while len(chunk) < self._chunk_size:
+            raw_block = _read_raw_block(self._file)
+            if raw_block is None:
+                break
+            chunk.append(raw_block)
+        return chunk
+
+    # Yields decompressed blocks in order. The next chunk is submitted before the current one is
+    # consumed so that inflation overlaps with parsing.
+    def _iter_blocks(self):
+        if self._pool is None:
+            chunk = self._read_raw_chunk()
+            while chunk:
+                for raw_block in chunk:
+                    yield _inflate_block(raw_block)
+                chunk = self._read_raw_chunk()
+            return
+        chunk = self._read_raw_chunk()
+        pending = self._pool.map_async(_inflate_block, chunk) if chunk else None
+        while pending is not None:
+            chunk = self._read_raw_chunk()
+            next_pending = self._pool.map_async(_inflate_block, chunk) if chunk else None
+            for data in pending.get():
+                yield data
+            pending = next_pending
+
+    # Appends the next non-empty block to the unread part of the buffer
+    def _fill_buffer(self):
+        for data in self._blocks:
+            if data:
+                self._buffer = self._buffer[self._offset:] + data
+                self._offset = 0
+                return True
+        return False
+
+    def _take_buffer(self):
+        data = self._buffer[self._offset:]
+        self._buffer = b''
+        self._offset = 0
+        return data
+
+    def readline(self):
+        while True:
+            newline_index = self._buffer.find(b'\n', self._offset)
+            if newline_index >= 0:
+                line = self._buffer[self._offset:newline_index + 1]
+                self._offset = newline_index + 1
+                return line
+            if not self._fill_buffer():
+                return self._take_buffer()
+
+    def read(self):
+        return self._take_buffer() + b''.join(self._blocks)
+
+    def __iter__(self):
+        while True:
+            lines = self._take_buffer().split(b'\n')
+            self._buffer = lines.pop()
+            for line in lines:
+                yield line + b'\n'
+            if not self._fill_buffer():
+                break
+        line = self._take_buffer()
+        if line:
+            yield line
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+# Write-only file object producing BGZF output readable by both gzip and BgzfReader.
+class BgzfWriter:
+    def __init__(self, file_path, level=DEFAULT_COMPRESSION_LEVEL):
+        self.name = file_path
+        self.closed = False
+        self._file = open(file_path, 'wb')
+        self._level = level
+        self._buffer = []
+        self._buffer_size = 0
+
+    def _flush_blocks(self, flush_all):
+        data = b''.join(self._buffer)
+        pos = 0
+        while len(data) - pos >= BGZF_MAX_BLOCK_DATA_SIZE or (flush_all and pos < len(data)):
+            self._file.write(_deflate_block(data[pos:pos + BGZF_MAX_BLOCK_DATA_SIZE], self._level))
+            pos += BGZF_MAX_BLOCK_DATA_SIZE
+        data = data[pos:]
+        self._buffer = [data] if data else []
+        self._buffer_size = len(data)
+
+    def write(self, data):
+        self._buffer.append(data)
+        self._buffer_size += len(data)
+        if self._buffer_size >= BGZF_MAX_BLOCK_DATA_SIZE:
+            self._flush_blocks(False)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self._flush_blocks(True)
+        self._file.write(BGZF_EOF_BLOCK)
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
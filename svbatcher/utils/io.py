@@ -8,9 +8,16 @@
 ######################################################
 
 from svbatcher.data_types import Individual, Family
-from svbatcher.utils import printers
+from svbatcher.utils import printers, bgzf
 from os import path
+import os
 import gzip
+import numpy as np
+import threading
+try:
+    import Queue as queue
+except ImportError:
+    import queue
 
 # Properties of expected input data
 HEADER_SYMBOL = '#'
@@ -32,9 +39,20 @@ SEX_ASSIGNMENT_FEMALE_STRING = "FEMALE"
 WGD_SAMPLE_COLUMN_NAME = "ID"
 WGD_SCORE_COLUMN_NAME = "score"
 
+# Maximum number of computed batches waiting to be written
+DEFAULT_WRITE_QUEUE_SIZE = 4
 
-def open_possibly_gzipped(file_path, mode):
-    return gzip.open(file_path, mode) if file_path.endswith('.gz') else open(file_path, mode)
+# Suffix of batch files written by the streaming writer until all batches have passed the final checks
+TEMP_BATCH_SUFFIX = ".tmp"
+
+
+# Blocked gzip files opened for reading are inflated in parallel; plain gzip files are streamed
+def open_possibly_gzipped(file_path, mode, num_threads=None):
+    if not file_path.endswith('.gz'):
+        return open(file_path, mode)
+    if 'r' in mode and bgzf.is_bgzf(file_path):
+        return bgzf.BgzfReader(file_path, num_threads=num_threads)
+    return gzip.open(file_path, mode)
 
 
 def _get_column_index(header, name):
@@ -120,35 +138,123 @@ def read_wgd_list(file_list_path, individuals_dict):
     return individuals_dict
 
 
-# Reads ped file and creates families from existing population of Individuals
-def assign_families(ped_file, individuals_dict):
+# Creates families from (family_id, sample_id, is_proband) records and existing population of Individuals
+def _assign_families(records, individuals_dict):
     families = {}
-    with open(ped_file, 'r') as f:
-        for line in f:
-            if line.startswith(HEADER_SYMBOL):
-                continue
-            tokens = line.strip().split('\t')
-            num_cols = len(tokens)
-            if num_cols < PED_SAMPLE_ID_COLUMN+1 or num_cols < PED_FAMILY_ID_COLUMN+1:
-                printers.raise_error("Not enough columns in PED file line: \"" + line.strip() + "\"")
-            family_id = tokens[PED_FAMILY_ID_COLUMN]
-            sample_id = tokens[PED_SAMPLE_ID_COLUMN]
-            if sample_id in individuals_dict:
-                if tokens[PED_PROBAND_COLUMN] == PED_PROBAND_VALUE:
-                    individuals_dict[sample_id].proband = True
-                else:
-                    individuals_dict[sample_id].proband = False
-                if family_id not in families:
-                    families[family_id] = []
-                families[family_id].append(individuals_dict[sample_id])
+    for family_id, sample_id, is_proband in records:
+        if sample_id in individuals_dict:
+            individuals_dict[sample_id].proband = is_proband
+            if family_id not in families:
+                families[family_id] = []
+            families[family_id].append(individuals_dict[sample_id])
     return [Family(family_id, families[family_id]) for family_id in families]
 
 
+# Yields records only for samples in individuals_dict
+def _read_ped_records(f, individuals_dict):
+    for line in f:
+        if line.startswith(HEADER_SYMBOL):
+            continue
+        tokens = line.strip().split('\t')
+        num_cols = len(tokens)
+        if num_cols < PED_SAMPLE_ID_COLUMN+1 or num_cols < PED_FAMILY_ID_COLUMN+1:
+            printers.raise_error("Not enough columns in PED file line: \"" + line.strip() + "\"")
+        if tokens[PED_SAMPLE_ID_COLUMN] not in individuals_dict:
+            continue
+        yield tokens[PED_FAMILY_ID_COLUMN], tokens[PED_SAMPLE_ID_COLUMN], tokens[PED_PROBAND_COLUMN] == PED_PROBAND_VALUE
+
+
+# Reads ped file and creates families from existing population of Individuals
+def assign_families(ped_file, individuals_dict):
+    with open_possibly_gzipped(ped_file, 'r') as f:
+        return _assign_families(_read_ped_records(f, individuals_dict), individuals_dict)
+
+
+# Converts a proband column to booleans. Accepts booleans or PED phenotype codes as strings or
+# integers, where PED_PROBAND_VALUE marks probands.
+def get_proband_flags(proband):
+    proband = np.asarray(proband)
+    if proband.dtype.kind == 'b':
+        return proband
+    values = proband.tolist()
+    if proband.dtype.kind in 'SU' or all([isinstance(x, basestring) for x in values]):
+        return np.array([x == PED_PROBAND_VALUE for x in values], dtype=bool)
+    if all([isinstance(x, bool) for x in values]):
+        return proband.astype(bool)
+    if proband.dtype.kind in 'iu' or all([isinstance(x, (int, long)) and not isinstance(x, bool) for x in values]):
+        return np.array([x == int(PED_PROBAND_VALUE) for x in values], dtype=bool)
+    printers.raise_error("Proband values must be booleans or PED phenotype codes (" + PED_PROBAND_VALUE + " for probands)")
+
+
+# Creates families from pedigree arrays and existing population of Individuals
+def assign_families_from_arrays(family_ids, sample_ids, proband, individuals_dict):
+    proband = get_proband_flags(proband).tolist()
+    return _assign_families(zip([str(x) for x in family_ids], [str(x) for x in sample_ids], proband), individuals_dict)
+
+
+def get_batch_path(batch_index, output_dir):
+    return path.join(output_dir, "batch." + str(batch_index) + ".txt")
+
+
+def write_batch(batch, batch_index, output_dir, suffix=""):
+    file_path = get_batch_path(batch_index, output_dir) + suffix
+    with open(file_path, 'w') as f:
+        f.write("#" + Family.TABLE_HEADER_STRING + "\n")
+        for family in batch:
+            f.write("\n".join(family.table_strings()) + "\n")
+
+
 def write_output(batches, output_dir):
     for i in range(len(batches)):
-        file_path = path.join(output_dir, "batch." + str(i) + ".txt")
-        with open(file_path, 'w') as f:
-            f.write("#" + Family.TABLE_HEADER_STRING + "\n")
-            batch_out = batches[i]
-            for family in batch_out:
-                f.write("\n".join(family.table_strings()) + "\n")
+        write_batch(batches[i], i, output_dir)
+
+
+def _write_batches_from_queue(batch_queue, output_dir, errors):
+    batch_index = 0
+    while True:
+        batch = batch_queue.get()
+        if batch is None:
+            return
+        # After a failure keep draining so the producer never blocks on a full queue
+        if not errors:
+            try:
+                write_batch(batch, batch_index, output_dir, suffix=TEMP_BATCH_SUFFIX)
+            except Exception as e:
+                errors.append(e)
+        batch_index += 1
+
+
+# Consumes batches from an iterable on the calling thread while a writer thread writes them to disk.
+# The bounded queue limits how many batches are held in memory at once. Batches are written under
+# temporary names and only renamed once the iterable is exhausted without error, so a failed run
+# leaves no batch files behind. Returns the number of batches.
+def write_output_streaming(batches, output_dir, queue_size=DEFAULT_WRITE_QUEUE_SIZE):
+    batch_queue = queue.Queue(maxsize=queue_size)
+    errors = []
+    writer = threading.Thread(target=_write_batches_from_queue, args=(batch_queue, output_dir, errors))
+    writer.daemon = True
+    writer.start()
+    num_batches = 0
+    succeeded = False
+    try:
+        try:
+            for batch in batches:
+                if errors:
+                    break
+                batch_queue.put(batch)
+                num_batches += 1
+        finally:
+            batch_queue.put(None)
+            writer.join()
+        if errors:
+            raise errors[0]
+        for i in range(num_batches):
+            os.rename(get_batch_path(i, output_dir) + TEMP_BATCH_SUFFIX, get_batch_path(i, output_dir))
+        succeeded = True
+    finally:
+        if not succeeded:
+            for i in range(num_batches):
+                temp_path = get_batch_path(i, output_dir) + TEMP_BATCH_SUFFIX
+                if path.exists(temp_path):
+                    os.remove(temp_path)
+    return num_batches